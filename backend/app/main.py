@@ -1,15 +1,37 @@
-import os, io, json, uuid, hashlib, time, asyncio
-from typing import Optional
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Request
+import os, io, json, uuid, time, asyncio, tempfile, functools, sqlite3, stat, threading
+import contextlib
+from collections import Counter
+from typing import Dict, Optional, Set, Tuple
+from fastapi import (
+    FastAPI,
+    UploadFile,
+    File,
+    HTTPException,
+    Request,
+)
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import (
+    FileResponse,
+    ORJSONResponse,
+    Response,
+    StreamingResponse,
+)
 from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.staticfiles import NotModifiedResponse
 from pydantic import BaseModel
 from PIL import Image
 import sqlalchemy as sa
 from sqlalchemy.orm import sessionmaker, declarative_base
 from dotenv import load_dotenv
+import aiofiles
+import ahocorasick
+import blake3
+import anyio.to_thread
+import httpx
+import orjson
 import replicate
+from replicate.prediction import Prediction
 
 # Load environment variables from .env file
 load_dotenv()
@@ -23,6 +45,13 @@ STATIC_INDEX_PATH = os.path.join(DATA_DIR, "static_index.json")
 EXTERNAL_API_URL = os.getenv(
     "EXTERNAL_API_URL", "http://external-model/api/generate"
 )  # replace when ready
+MAX_UPLOAD_BYTES = 15 * 1024 * 1024
+STREAM_CHUNK_SIZE = 1 << 20
+HASH_MAX_DIM = 1024  # longest side used for image cache keys
+SSE_HEARTBEAT_SECONDS = 15
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "40"))  # sync route handlers
+TASK_LEASE_SECONDS = 60  # a running task's claim, renewed while it runs
+WORKER_ID = uuid.uuid4().hex  # identifies this process's task claims
 REPLICATE_API_TOKEN = os.getenv("REPLICATE_API_TOKEN")
 os.environ["REPLICATE_API_TOKEN"] = REPLICATE_API_TOKEN  # Set for replicate client
 
@@ -33,8 +62,21 @@ os.makedirs(STATIC_MODELS_DIR, exist_ok=True)
 # ---- DB (SQLite) ----
 DB_PATH = os.getenv("DB_PATH", os.path.join(DATA_DIR, "app.db"))
 engine = sa.create_engine(
-    f"sqlite:///{DB_PATH}", connect_args={"check_same_thread": False}
+    f"sqlite:///{DB_PATH}", connect_args={"check_same_thread": False, "timeout": 30}
 )
+
+
+@sa.event.listens_for(engine, "connect")
+def _sqlite_pragmas(dbapi_conn, _record):
+    # WAL lets status/SSE readers run alongside the worker's writes
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.execute("PRAGMA mmap_size=268435456")
+    cur.close()
+
+
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 Base = declarative_base()
 
@@ -47,19 +89,63 @@ class Task(Base):
     )  # queued | started | finished | failed
     filename = sa.Column(sa.String, nullable=True)
     error = sa.Column(sa.String, nullable=True)
+    prediction_id = sa.Column(sa.String, nullable=True)  # Replicate prediction
+    image_hash = sa.Column(sa.String, nullable=True)  # ImageCache key of the upload
+    owner = sa.Column(sa.String, nullable=True)  # WORKER_ID running the task
+    lease_until = sa.Column(sa.Float, nullable=True)  # owner's claim expiry (epoch)
 
 
 class ImageCache(Base):
     __tablename__ = "image_cache"
-    hash = sa.Column(sa.String, primary_key=True)  # normalized SHA256
+    hash = sa.Column(sa.String, primary_key=True)  # BLAKE3 of normalized pixels
     filename = sa.Column(sa.String, nullable=False)
 
 
 Base.metadata.create_all(bind=engine)
 
+# create_all doesn't alter existing tables; add columns introduced later
+with engine.begin() as conn:
+    task_columns = {c["name"] for c in sa.inspect(conn).get_columns("tasks")}
+    for name, ddl in (
+        ("prediction_id", "VARCHAR"),
+        ("image_hash", "VARCHAR"),
+        ("owner", "VARCHAR"),
+        ("lease_until", "FLOAT"),
+    ):
+        if name not in task_columns:
+            conn.exec_driver_sql(f"ALTER TABLE tasks ADD COLUMN {name} {ddl}")
+
+
+# Status polls are single-row PK reads; skip the ORM and reuse one connection
+# (sqlite3 caches the prepared statement).
+_status_conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=30)
+_status_lock = threading.Lock()
+
+
+def fetch_task_status(task_id: str) -> Optional[Tuple[str, str, str]]:
+    """Return (status, filename, error) for task_id, or None if unknown."""
+    with _status_lock:
+        return _status_conn.execute(
+            "SELECT status, filename, error FROM tasks WHERE id = ?", (task_id,)
+        ).fetchone()
+
+
 # ---- App ----
 
-app = FastAPI(title="3D Model Generator", version="1.0.0")
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    configure_threadpool()
+    await resume_pending_tasks()
+    yield
+
+
+app = FastAPI(
+    title="3D Model Generator",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
 
 # Enable CORS
 app.add_middleware(
@@ -70,81 +156,280 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+def file_etag(stat_result: os.stat_result) -> str:
+    """Strong ETag derived from size + mtime; no hashing of the file body."""
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (c.strip().removeprefix("W/") for c in if_none_match.split(","))
+    return etag in candidates
+
+
+class CachedStatic(StaticFiles):
+    """StaticFiles that lets browsers revalidate GLBs with If-None-Match."""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = FileResponse(
+            full_path,
+            status_code=status_code,
+            headers={
+                "etag": file_etag(stat_result),
+                "cache-control": "public, max-age=3600",
+            },
+            stat_result=stat_result,
+            method=scope["method"],
+        )
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def is_not_modified(self, response_headers, request_headers) -> bool:
+        # If-None-Match takes precedence over If-Modified-Since (RFC 9110)
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is None:
+            return super().is_not_modified(response_headers, request_headers)
+        return etag_matches(if_none_match, response_headers["etag"])
+
+
+def configure_threadpool() -> None:
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+
+
 # Serve models directly at /models/<filename>
-app.mount("/models", StaticFiles(directory=MODELS_DIR), name="models")
+app.mount("/models", CachedStatic(directory=MODELS_DIR), name="models")
 app.mount(
-    "/static_models", StaticFiles(directory=STATIC_MODELS_DIR), name="static_models"
+    "/static_models", CachedStatic(directory=STATIC_MODELS_DIR), name="static_models"
 )
 
+
 class TextReq(BaseModel):
     prompt: str
 
 
 # ---- Helpers ----
-def normalize_bytes_for_hash(raw: bytes) -> bytes:
+def normalize_image_for_hash(path: str) -> Tuple[Tuple[int, int], bytes]:
     """
-    Canonicalize image by decoding and re-encoding to PNG (strips EXIF/metadata,
-    normalizes color space). Using PNG ensures deterministic bytes for exact-match caching.
+    Canonicalize image by decoding to raw RGBA pixels (strips EXIF/metadata,
+    normalizes color space). Hashing pixels avoids a PNG re-encode for exact-match caching.
+    Images are capped at HASH_MAX_DIM so decode + hash cost stays bounded.
     """
-    img = Image.open(io.BytesIO(raw)).convert("RGBA")
-    buf = io.BytesIO()
-    img.save(buf, format="PNG", optimize=True)
-    return buf.getvalue()
+    with Image.open(path) as img:
+        # JPEGs decode directly at a reduced DCT scale when they are oversized
+        img.draft("RGB", (HASH_MAX_DIM, HASH_MAX_DIM))
+        img.thumbnail((HASH_MAX_DIM, HASH_MAX_DIM))
+        if img.mode != "RGBA":
+            img = img.convert("RGBA")
+        return img.size, img.tobytes()
+
+
+def hash_pixels(size: Tuple[int, int], pixels: bytes) -> str:
+    # Large buffers are worth spreading over blake3's own thread pool
+    threads = blake3.blake3.AUTO if len(pixels) >= 1 << 20 else 1
+    h = blake3.blake3(f"{size[0]}x{size[1]}|".encode(), max_threads=threads)
+    h.update(pixels)
+    return h.hexdigest()
 
 
-def sha256(b: bytes) -> str:
-    return hashlib.sha256(b).hexdigest()
+def image_cache_key(path: str) -> str:
+    size, pixels = normalize_image_for_hash(path)
+    return hash_pixels(size, pixels)
+
+
+def store_upload_png(src_path: str, dest_path: str) -> None:
+    """Move the upload to dest_path, re-encoding it to PNG unless it already is one."""
+    with Image.open(src_path) as img:
+        if img.format != "PNG":
+            img.convert("RGBA").save(dest_path, format="PNG")
+            return
+    os.replace(src_path, dest_path)
+
+
+async def save_upload(file: UploadFile) -> str:
+    """Stream an upload to a temp file in UPLOADS_DIR, enforcing the size limit."""
+    size = 0
+    with tempfile.NamedTemporaryFile(
+        dir=UPLOADS_DIR, suffix=".bin", delete=False
+    ) as tmp:
+        while chunk := await file.read(STREAM_CHUNK_SIZE):
+            size += len(chunk)
+            if size > MAX_UPLOAD_BYTES:
+                break
+            tmp.write(chunk)
+    if not size or size > MAX_UPLOAD_BYTES:
+        os.unlink(tmp.name)
+        raise HTTPException(400, "Invalid file size")
+    return tmp.name
+
+
+# Parsed static index + keyword automaton, rebuilt only when the file's mtime changes
+_INDEX_CACHE = {"mtime": 0, "data": {}, "automaton": None}
+
+
+def build_keyword_automaton(index: dict) -> Optional[ahocorasick.Automaton]:
+    # Each keyword maps to the (rank, filename) pairs listing it; rank keeps
+    # ties resolved in index order.
+    owners = {}
+    for rank, (fname, kws) in enumerate(index.items()):
+        for k in kws:
+            owners.setdefault(k, []).append((rank, fname))
+    if not owners:
+        return None
+    automaton = ahocorasick.Automaton()
+    for k, files in owners.items():
+        automaton.add_word(k, (k, tuple(files)))
+    automaton.make_automaton()
+    return automaton
 
 
 def load_static_index() -> dict:
-    # list data dir
-    print(os.listdir(DATA_DIR))
-    if not os.path.exists(STATIC_INDEX_PATH):
+    try:
+        st = os.stat(STATIC_INDEX_PATH)
+    except FileNotFoundError:
+        if _INDEX_CACHE["mtime"]:
+            _INDEX_CACHE.update(mtime=0, data={}, automaton=None)
+            clear_match_caches()
         return {}
-    with open(STATIC_INDEX_PATH, "r") as f:
-        return json.load(f)
+    if st.st_mtime_ns != _INDEX_CACHE["mtime"]:
+        with open(STATIC_INDEX_PATH, "r") as f:
+            data = json.load(f)
+        _INDEX_CACHE.update(
+            mtime=st.st_mtime_ns, data=data, automaton=build_keyword_automaton(data)
+        )
+        clear_match_caches()
+    return _INDEX_CACHE["data"]
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(prompt.lower().split())
+
+
+@functools.lru_cache(maxsize=4096)
+def _match_cached(prompt_norm: str, index_mtime: int) -> Optional[str]:
+    # index_mtime only keys the entry, so results from an older index never hit
+    return keyword_match(prompt_norm, _INDEX_CACHE["automaton"])
+
 
+def match_static_model(prompt: str) -> Optional[str]:
+    load_static_index()
+    return _match_cached(normalize_prompt(prompt), _INDEX_CACHE["mtime"])
 
-def keyword_match(prompt: str, index: dict) -> Optional[str]:
-    p = prompt.lower()
-    best, best_score = None, 0
-    print(index)
+
+@functools.lru_cache(maxsize=256)
+def static_match_body(fname: str) -> bytes:
+    """Pre-serialized /generate-model/text response for a matched file."""
+    return orjson.dumps(
+        {"filename": fname, "url": f"/api/static_models/{fname}", "source": "static"}
+    )
+
+
+def clear_match_caches() -> None:
+    _match_cached.cache_clear()
+    static_match_body.cache_clear()
+
+
+def keyword_match(
+    prompt: str, automaton: Optional[ahocorasick.Automaton]
+) -> Optional[str]:
+    if automaton is None:
+        return None
     # index format example: {"office_chair_wheels.glb": ["chair","wheels","office"]}
-    for fname, kws in index.items():
-        score = sum(1 for k in kws if k in p)
-        if score > best_score:
-            best, best_score = fname, score
+    # Single pass over the prompt; each distinct keyword scores once per file.
+    matched = {k: files for _, (k, files) in automaton.iter(prompt.lower())}
+    scores = Counter(f for files in matched.values() for f in files)
+    if not scores:
+        return None
+    (_, best), _ = min(scores.items(), key=lambda kv: (-kv[1], kv[0][0]))
     return best
 
 
-def call_external_model(image_path: str) -> bytes:
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+TRELLIS_VERSION = "e8f6c45206993f297372f5436b90350817bd9b4a0d52d2a76df50c1c8afa2b3c"
+TRELLIS_INPUT = {
+    "seed": 0,
+    "texture_size": 2048,
+    "mesh_simplify": 0.9,
+    "generate_color": True,
+    "generate_model": True,
+    "randomize_seed": True,
+    "generate_normal": False,
+    "save_gaussian_ply": True,
+    "ss_sampling_steps": 38,
+    "slat_sampling_steps": 12,
+    "return_no_background": False,
+    "ss_guidance_strength": 7.5,
+    "slat_guidance_strength": 3,
+}
+
+
+async def start_external_model(image_path: str) -> Prediction:
     """
+    Submit image_path to firtoz/trellis and return the pending prediction.
     Replace with a real HTTP call when ready, e.g.:
       files = {"file": ("upload.png", open(image_path, "rb"), "image/png")}
-      resp = requests.post(EXTERNAL_API_URL, files=files, timeout=120)
-      resp.raise_for_status()
-      return resp.content
+      resp = await client.post(EXTERNAL_API_URL, files=files, timeout=120)
     """
-    output = replicate.run(
-        "firtoz/trellis:e8f6c45206993f297372f5436b90350817bd9b4a0d52d2a76df50c1c8afa2b3c",
-        input={
-            "seed": 0,
-            "images": [open(image_path, "rb")],
-            "texture_size": 2048,
-            "mesh_simplify": 0.9,
-            "generate_color": True,
-            "generate_model": True,
-            "randomize_seed": True,
-            "generate_normal": False,
-            "save_gaussian_ply": True,
-            "ss_sampling_steps": 38,
-            "slat_sampling_steps": 12,
-            "return_no_background": False,
-            "ss_guidance_strength": 7.5,
-            "slat_guidance_strength": 3,
-        },
+    loop = asyncio.get_running_loop()
+    image = io.BytesIO(await loop.run_in_executor(None, read_file, image_path))
+    image.name = os.path.basename(image_path)  # replicate derives the mime type
+    return await replicate.predictions.async_create(
+        version=TRELLIS_VERSION, input={**TRELLIS_INPUT, "images": [image]}
     )
-    return output["model_file"].read()
+
+
+async def finish_external_model(prediction: Prediction, out_path: str) -> None:
+    """Wait for prediction to complete and stream its model file to out_path."""
+    await prediction.async_wait()
+    if prediction.status != "succeeded":
+        raise RuntimeError(prediction.error or f"Prediction {prediction.status}")
+
+    # Write to a sibling file first so /models never serves a partial GLB. The
+    # prediction id keeps concurrent tasks for the same image on separate files.
+    part_path = f"{out_path}.{prediction.id}.part"
+    loop = asyncio.get_running_loop()
+    try:
+        async with httpx.AsyncClient(timeout=120) as client:
+            async with client.stream("GET", prediction.output["model_file"]) as resp:
+                resp.raise_for_status()
+                async with aiofiles.open(part_path, "wb") as f:
+                    async for chunk in resp.aiter_bytes(STREAM_CHUNK_SIZE):
+                        await f.write(chunk)
+        await loop.run_in_executor(None, os.replace, part_path, out_path)
+    finally:
+        if os.path.exists(part_path):
+            await loop.run_in_executor(None, os.unlink, part_path)
+
+
+# task_id -> Event set on the next status change. Each change swaps in a fresh
+# Event, so a listener that grabbed the old one before reading the DB still wakes.
+TASK_EVENTS: Dict[str, asyncio.Event] = {}
+
+
+def notify_task(task_id: str, final: bool = False) -> None:
+    """Wake SSE listeners of task_id. Must run on the event loop thread."""
+    changed = TASK_EVENTS.pop(task_id, None)
+    if changed is None:
+        return
+    if not final:
+        TASK_EVENTS[task_id] = asyncio.Event()
+    changed.set()
+
+
+# Strong refs so running generations aren't garbage collected mid-flight
+_BACKGROUND_JOBS: Set[asyncio.Task] = set()
+
+
+def spawn_background(coro) -> None:
+    job = asyncio.create_task(coro)
+    _BACKGROUND_JOBS.add(job)
+    job.add_done_callback(_BACKGROUND_JOBS.discard)
 
 
 def safe_filename(stem: str, ext=".glb") -> str:
@@ -152,152 +437,329 @@ def safe_filename(stem: str, ext=".glb") -> str:
     return stem + ext
 
 
-def background_generate(task_id: str, image_bytes: bytes):
+# ---- Task state ----
+# Blocking DB calls; coroutines run them via run_in_executor. A task is run by
+# whichever worker holds its lease, so restarts and multi-worker deployments
+# never submit the same generation twice.
+
+
+def claim_task(task_id: str) -> bool:
+    """Atomically take task_id unless another worker holds a live lease on it."""
+    now = time.time()
+    with engine.begin() as conn:
+        result = conn.execute(
+            sa.update(Task)
+            .where(
+                Task.id == task_id,
+                Task.status.in_(("queued", "started")),
+                sa.or_(
+                    Task.owner == WORKER_ID,
+                    Task.lease_until.is_(None),
+                    Task.lease_until < now,
+                ),
+            )
+            .values(
+                status="started", owner=WORKER_ID, lease_until=now + TASK_LEASE_SECONDS
+            )
+        )
+    return result.rowcount == 1
+
+
+def renew_lease(task_id: str) -> None:
+    with engine.begin() as conn:
+        conn.execute(
+            sa.update(Task)
+            .where(Task.id == task_id, Task.owner == WORKER_ID)
+            .values(lease_until=time.time() + TASK_LEASE_SECONDS)
+        )
+
+
+def update_task(task_id: str, **values) -> None:
+    with engine.begin() as conn:
+        conn.execute(sa.update(Task).where(Task.id == task_id).values(**values))
+
+
+def insert_task(task_id: str, image_hash: str) -> str:
+    """
+    Insert a queued task for image_hash unless one is already in flight, and
+    return the id of the task that will produce the model.
+    """
+    in_flight = sa.select(Task.id).where(
+        Task.image_hash == image_hash, Task.status.in_(("queued", "started"))
+    )
+    # Created already claimed, so a worker resuming at startup leaves it alone
+    row = sa.select(
+        sa.literal(task_id),
+        sa.literal("queued"),
+        sa.literal(image_hash),
+        sa.literal(WORKER_ID),
+        sa.literal(time.time() + TASK_LEASE_SECONDS),
+    ).where(~in_flight.exists())
+    while True:
+        with engine.begin() as conn:
+            # Single INSERT ... SELECT, so concurrent uploads can't both insert
+            inserted = conn.execute(
+                sa.insert(Task).from_select(
+                    ["id", "status", "image_hash", "owner", "lease_until"], row
+                )
+            ).rowcount
+            if inserted:
+                return task_id
+            existing = conn.execute(in_flight.limit(1)).scalar()
+        if existing:
+            return existing
+        # The in-flight task finished in between; try inserting again
+
+
+def complete_task(task_id: str, image_hash: str, filename: str) -> None:
     session = SessionLocal()
     try:
-        # mark started
+        # Update cache (exact image → filename)
+        session.merge(ImageCache(hash=image_hash, filename=filename))
         t = session.get(Task, task_id)
-        if not t:
-            return
-        t.status = "started"
+        if t:
+            t.filename = filename
+            t.status = "finished"
         session.commit()
+    finally:
+        session.close()
 
-        # Persist upload (optional)
-        upload_path = os.path.join(UPLOADS_DIR, f"{task_id}.png")
-        with open(upload_path, "wb") as f:
-            f.write(image_bytes)
 
-        # External call
-        model_bytes = call_external_model(upload_path)
+def cached_model(image_hash: str) -> Optional[str]:
+    session = SessionLocal()
+    try:
+        cached = session.get(ImageCache, image_hash)
+        return cached.filename if cached else None
+    finally:
+        session.close()
+
 
-        # Save model
-        short_hash = sha256(image_bytes)[:8]
+def pending_tasks() -> list:
+    """(id, prediction_id, image_hash, lease_until) of unfinished tasks."""
+    with engine.connect() as conn:
+        return conn.execute(
+            sa.select(
+                Task.id, Task.prediction_id, Task.image_hash, Task.lease_until
+            ).where(Task.status.in_(("queued", "started")))
+        ).all()
+
+
+def pending_task(task_id: str) -> Optional[Tuple[Optional[str], Optional[float]]]:
+    """(prediction_id, lease_until) if task_id is still unfinished."""
+    with engine.connect() as conn:
+        return conn.execute(
+            sa.select(Task.prediction_id, Task.lease_until).where(
+                Task.id == task_id, Task.status.in_(("queued", "started"))
+            )
+        ).first()
+
+
+async def keep_lease(task_id: str) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(TASK_LEASE_SECONDS / 3)
+        try:
+            await loop.run_in_executor(None, renew_lease, task_id)
+        except Exception:
+            pass  # a busy DB only delays renewal; the next round retries
+
+
+async def background_generate(
+    task_id: str,
+    upload_path: str,
+    image_hash: str,
+    prediction_id: Optional[str] = None,
+):
+    loop = asyncio.get_running_loop()
+    if not await loop.run_in_executor(None, claim_task, task_id):
+        return  # finished, or running on another worker
+    notify_task(task_id)
+    lease = asyncio.create_task(keep_lease(task_id))
+    try:
+        # External call; the prediction id lets a restart resume instead of resubmit
+        if prediction_id is None:
+            prediction = await start_external_model(upload_path)
+            await loop.run_in_executor(
+                None,
+                functools.partial(update_task, task_id, prediction_id=prediction.id),
+            )
+        else:
+            prediction = await replicate.predictions.async_get(prediction_id)
+
+        # Stream the result straight into the models dir
+        short_hash = image_hash[:8]
         out_name = safe_filename(f"model-{short_hash}")
         out_path = os.path.join(MODELS_DIR, out_name)
-        with open(out_path, "wb") as f:
-            f.write(model_bytes)
-
-        # Update cache (exact image → filename)
-        ic = ImageCache(hash=sha256(image_bytes), filename=out_name)
-        session.merge(ic)
+        await finish_external_model(prediction, out_path)
 
-        # Mark finished
-        t.filename = out_name
-        t.status = "finished"
-        session.commit()
+        await loop.run_in_executor(None, complete_task, task_id, image_hash, out_name)
     except Exception as e:
-        t = session.get(Task, task_id)
-        if t:
-            t.status = "failed"
-            t.error = str(e)[:1000]
-            session.commit()
+        await loop.run_in_executor(
+            None,
+            functools.partial(
+                update_task, task_id, status="failed", error=str(e)[:1000]
+            ),
+        )
     finally:
-        session.close()
+        lease.cancel()
+        notify_task(task_id, final=True)
+
+
+async def resume_task(
+    task_id: str,
+    prediction_id: Optional[str],
+    image_hash: Optional[str],
+    lease_until: Optional[float],
+) -> None:
+    """Resume task_id once no live worker holds it."""
+    loop = asyncio.get_running_loop()
+    upload_path = os.path.join(UPLOADS_DIR, f"{task_id}.png")
+    if image_hash is None:
+        # Tasks created before the hash was stored on the row
+        try:
+            image_hash = await loop.run_in_executor(None, image_cache_key, upload_path)
+        except Exception:
+            await loop.run_in_executor(
+                None,
+                functools.partial(
+                    update_task,
+                    task_id,
+                    status="failed",
+                    error="Upload missing after restart",
+                ),
+            )
+            notify_task(task_id, final=True)
+            return
+    while True:
+        # Wait out another worker's lease, then race for the claim
+        if lease_until and lease_until > time.time():
+            await asyncio.sleep(lease_until - time.time())
+        await background_generate(task_id, upload_path, image_hash, prediction_id)
+        row = await loop.run_in_executor(None, pending_task, task_id)
+        if row is None:
+            notify_task(task_id, final=True)
+            return
+        prediction_id, lease_until = row
+
+
+async def resume_pending_tasks():
+    """Pick up generations interrupted by a restart, reusing their prediction."""
+    loop = asyncio.get_running_loop()
+    for task_id, prediction_id, image_hash, lease_until in await loop.run_in_executor(
+        None, pending_tasks
+    ):
+        TASK_EVENTS[task_id] = asyncio.Event()
+        spawn_background(resume_task(task_id, prediction_id, image_hash, lease_until))
 
 
 @app.post("/generate-model/text")
 def generate_model_text(req: TextReq, request: Request):
-    index = load_static_index()
-    fname = keyword_match(req.prompt, index)
+    fname = match_static_model(req.prompt)
     if not fname:
         raise HTTPException(404, "No static model match")
     path = os.path.join(STATIC_MODELS_DIR, fname)
-    print(f"/api/static_models/{fname}")
     if not os.path.exists(path):
         raise HTTPException(500, "Model file missing on server")
-    return {"filename": fname, "url": f"/api/static_models/{fname}", "source": "static"}
+    return Response(static_match_body(fname), media_type="application/json")
 
 
 @app.post("/generate-model/image")
-async def generate_model_image(
-    background: BackgroundTasks, file: UploadFile = File(...)
-):
-    raw = await file.read()
-    if not raw or len(raw) > 15 * 1024 * 1024:
-        raise HTTPException(400, "Invalid file size")
-
-    # Normalize + exact-duplicate cache
+async def generate_model_image(file: UploadFile = File(...)):
+    tmp_path = await save_upload(file)
     try:
-        norm = normalize_bytes_for_hash(raw)
-    except Exception:
-        raise HTTPException(400, "Unsupported or corrupted image")
-    h = sha256(norm)
-
-    session = SessionLocal()
-    try:
-        cached = session.get(ImageCache, h)
+        # Normalize + exact-duplicate cache (decode/hash off the event loop)
+        loop = asyncio.get_running_loop()
+        try:
+            h = await loop.run_in_executor(None, image_cache_key, tmp_path)
+        except Exception:
+            raise HTTPException(400, "Unsupported or corrupted image")
+
+        cached = await loop.run_in_executor(None, cached_model, h)
         if cached:
-            url = f"/api/models/{cached.filename}"
-            return {"filename": cached.filename, "url": url, "source": "cache"}
+            url = f"/api/models/{cached}"
+            return {"filename": cached, "url": url, "source": "cache"}
 
-        # Create task, enqueue background work
+        # Persist upload, create task, enqueue background work
         task_id = str(uuid.uuid4())
-        session.add(Task(id=task_id, status="queued"))
-        session.commit()
-
-        background.add_task(background_generate, task_id=task_id, image_bytes=norm)
+        upload_path = os.path.join(UPLOADS_DIR, f"{task_id}.png")
+        await loop.run_in_executor(None, store_upload_png, tmp_path, upload_path)
+        followed = await loop.run_in_executor(None, insert_task, task_id, h)
+        if followed != task_id:
+            # Same image is already generating; follow that task instead of paying twice
+            await loop.run_in_executor(None, os.unlink, upload_path)
+            return {"task_id": followed, "status_url": f"/tasks/{followed}"}
+        TASK_EVENTS[task_id] = asyncio.Event()
+
+        spawn_background(background_generate(task_id, upload_path, h))
         return {"task_id": task_id, "status_url": f"/tasks/{task_id}"}
     finally:
-        session.close()
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
 
 
 @app.get("/tasks/{task_id}")
 def task_status(task_id: str, request: Request):
-    session = SessionLocal()
-    try:
-        t = session.get(Task, task_id)
-        if not t:
-            raise HTTPException(404, "Task not found")
-        data = {"status": t.status}
-        if t.status == "finished":
-            data["filename"] = t.filename
-            base = str(request.base_url).rstrip("/")
-            data["url"] = f"{base}/models/{t.filename}"
-        if t.status == "failed":
-            data["error"] = t.error
-        return data
-    finally:
-        session.close()
+    row = fetch_task_status(task_id)
+    if not row:
+        raise HTTPException(404, "Task not found")
+    status, filename, error = row
+    data = {"status": status}
+    if status == "finished":
+        data["filename"] = filename
+        base = str(request.base_url).rstrip("/")
+        data["url"] = f"{base}/models/{filename}"
+    if status == "failed":
+        data["error"] = error
+    return data
+
+
+# ---- SSE endpoint for task updates ----
+# Frames are pre-encoded bytes so Starlette doesn't re-encode every yield
+SSE_RETRY = b"retry: 3000\n\n"
+SSE_KEEPALIVE = b": keep-alive\n\n"
+SSE_NOT_FOUND = b'event: status\ndata: {"status":"not_found"}\n\n'
 
 
-# ---- NEW: SSE endpoint for task updates ----
-# ...existing code...
 @app.get("/tasks/{task_id}/events")
 async def task_events(task_id: str, request: Request):
 
     async def event_gen():
+        loop = asyncio.get_running_loop()
         last_status = None
         # Hint client to retry quickly
-        yield "retry: 3000\n\n"
+        yield SSE_RETRY
         while True:
             if await request.is_disconnected():
                 break
 
-            session = SessionLocal()
+            # Take the waiter before reading so a change in between isn't missed;
+            # tasks without one (finished, or from a previous run) just poll.
+            changed = TASK_EVENTS.get(task_id) or asyncio.Event()
+            # The shared connection's lock and busy timeout must not block the loop
+            row = await loop.run_in_executor(None, fetch_task_status, task_id)
+            if not row:
+                yield SSE_NOT_FOUND
+                break
+
+            status, filename, error = row
+            if status != last_status:
+                payload = {"status": status}
+                if status == "finished":
+                    payload["filename"] = filename
+                    payload["url"] = f"/api/models/{filename}"
+                if status == "failed":
+                    payload["error"] = error
+                yield b"event: status\ndata: " + orjson.dumps(payload) + b"\n\n"
+                last_status = status
+
+            if status in ("finished", "failed"):
+                break
+
+            # Sleep until the worker reports a change; heartbeat otherwise
             try:
-                t = session.get(Task, task_id)
-                if not t:
-                    yield 'event: status\ndata: {"status":"not_found"}\n\n'
-                    break
-
-                if t.status != last_status:
-                    payload = {"status": t.status}
-                    if t.status == "finished":
-                        payload["filename"] = t.filename
-                        payload["url"] = f"/api/models/{t.filename}"
-                    if t.status == "failed":
-                        payload["error"] = t.error
-                    yield f"event: status\ndata: {json.dumps(payload)}\n\n"
-                    last_status = t.status
-
-                if t.status in ("finished", "failed"):
-                    break
-            finally:
-                session.close()
-
-            # Heartbeat + cadence
-            yield ": keep-alive\n\n"
-            await asyncio.sleep(0.5)
+                await asyncio.wait_for(changed.wait(), timeout=SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield SSE_KEEPALIVE
 
     return StreamingResponse(
         event_gen(),
@@ -305,21 +767,35 @@ async def task_events(task_id: str, request: Request):
         headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},  # for nginx
     )
 
+
 @app.get("/download-model")
-def download_model(filename: str):
+def download_model(filename: str, request: Request):
     safe = os.path.basename(filename)
     path = os.path.join(MODELS_DIR, safe)
-    if not os.path.exists(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        st = None
+    if not safe or st is None or not stat.S_ISREG(st.st_mode):
         raise HTTPException(404, "File not found")
+
+    etag = file_etag(st)
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=86400"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
     # Use appropriate media type for GLB
-    return {
-        "filename": safe,
-        "url": f"/api/static_models/{safe}",
-        "source": "generated",
-    }
+    return FileResponse(
+        path,
+        media_type="model/gltf-binary",
+        filename=safe,
+        headers=headers,
+        stat_result=st,
+    )
 
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
-    return {"status": "healthy", "timestamp": time.time()}
+    # Returning the response directly skips FastAPI's jsonable_encoder pass
+    return ORJSONResponse({"status": "healthy", "timestamp": time.time()})
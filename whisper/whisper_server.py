@@ -1,21 +1,22 @@
 #!/usr/bin/env python3
 """
 Whisper Voice Server with WebSocket support
-Provides real-time speech-to-text transcription using OpenAI's Whisper model
+Provides real-time speech-to-text transcription using OpenAI's Whisper model,
+served through faster-whisper (CTranslate2) with INT8 weights
 """
 
 import asyncio
-import json
 import logging
 import io
-import tempfile
 import os
-from typing import Optional, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List
 import websockets
-import whisper
-import torch
-import soundfile as sf
+import ctranslate2
+from faster_whisper import WhisperModel, decode_audio
+from faster_whisper.vad import get_speech_timestamps
 import numpy as np
+import orjson
 from pathlib import Path
 
 # Configure logging
@@ -25,59 +26,324 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+SAMPLE_RATE = 16000  # Whisper's expected input rate
+STREAM_INTERVAL = 1.0  # Seconds between partial decodes of a stream
+STREAM_BUFFER_SECONDS = 30  # Uncommitted audio kept per stream (Whisper's window)
+STREAM_VAD_CONTEXT = 0.5  # Seconds of older audio included when checking new stream audio for speech
+STREAM_PROMPT_CHARS = 400  # Committed text fed back as decoder context
+PIPELINE_DEPTH = 4  # Decoded clips that may wait for the model
+
+
+def decode_audio_bytes(audio_data: bytes) -> np.ndarray:
+    """
+    Decode an encoded audio blob (WebM/Opus, WAV, MP3, ...) in memory to mono
+    float32 at 16 kHz, without a temp file or ffmpeg subprocess
+    """
+    return decode_audio(io.BytesIO(audio_data), sampling_rate=SAMPLE_RATE)
+
+
+def encode_message(payload: Dict[str, Any]) -> str:
+    """Serialize a message; sent as a text frame since the browser client JSON.parses it"""
+    return orjson.dumps(payload).decode()
+
+
+# Frames whose content never changes, serialized once
+PROCESSING_FRAME = encode_message({"type": "status", "message": "Processing audio..."})
+PONG_PREFIX = '{"type":"pong","timestamp":'
+AUDIO_FORMATS = ("container", "pcm16")  # Whole-message binary formats, see set_format
+BUSY_FRAME = encode_message({"type": "error", "message": "Busy: previous audio is still being transcribed"})
+MAX_COMMAND_SIZE = 4096  # Characters; commands are tiny, anything larger is rejected unparsed
+
+
+def has_speech(audio: np.ndarray) -> bool:
+    """Run the Silero VAD bundled with faster-whisper (ONNX, CPU) over 16 kHz samples"""
+    return bool(get_speech_timestamps(audio, sampling_rate=SAMPLE_RATE))
+
+
+def pcm16_to_float32(chunk: bytes) -> np.ndarray:
+    """Convert raw little-endian 16-bit PCM to float32 in [-1, 1)"""
+    samples = np.frombuffer(chunk, dtype="<i2").astype(np.float32)
+    # Scale in place: one float32 allocation per chunk instead of two
+    samples *= 1.0 / 32768.0
+    return samples
+
+
+class AudioStream:
+    """
+    Per-client streaming state: a bounded FIFO of uncommitted audio plus the
+    segments already committed. Each decode only covers the uncommitted tail.
+    """
+    
+    def __init__(self, language: str = None):
+        self.language = language
+        # Fixed-size backing store written in place; no reallocation per chunk
+        self.samples = np.zeros(STREAM_BUFFER_SECONDS * SAMPLE_RATE, dtype=np.float32)
+        self.length = 0
+        self.offset = 0.0  # Stream time (seconds) of buffer[0]
+        self.pending = 0  # Samples received since the last decode
+        self.committed: List[Dict[str, Any]] = []
+        self.task: Optional[asyncio.Task] = None
+    
+    def prompt(self) -> Optional[str]:
+        """
+        Tail of the committed text. Committed audio is dropped from the buffer,
+        so this carries its context into the next decode as prompt tokens,
+        which the decoder consumes in one pass rather than regenerating them.
+        """
+        text = " ".join(seg["text"] for seg in self.committed).strip()
+        return text[-STREAM_PROMPT_CHARS:] or None
+    
+    def recent(self) -> np.ndarray:
+        """Audio received since the last decode, plus a little context before it"""
+        count = self.pending + int(STREAM_VAD_CONTEXT * SAMPLE_RATE)
+        return self.buffer[-count:]
+    
+    @property
+    def buffer(self) -> np.ndarray:
+        """View of the uncommitted audio"""
+        return self.samples[:self.length]
+    
+    def _drop(self, count: int):
+        """Discard the oldest count samples, shifting the rest to the front"""
+        count = min(count, self.length)
+        self.samples[:self.length - count] = self.samples[count:self.length]
+        self.length -= count
+        self.offset += count / SAMPLE_RATE
+    
+    def append(self, samples: np.ndarray):
+        """Add samples, trimming the oldest audio beyond STREAM_BUFFER_SECONDS"""
+        capacity = len(self.samples)
+        self.pending += len(samples)
+        if len(samples) >= capacity:
+            self.offset += (self.length + len(samples) - capacity) / SAMPLE_RATE
+            self.samples[:] = samples[-capacity:]
+            self.length = capacity
+            return
+        overflow = self.length + len(samples) - capacity
+        if overflow > 0:
+            self._drop(overflow)
+        self.samples[self.length:self.length + len(samples)] = samples
+        self.length += len(samples)
+    
+    def commit(self, segments: List[Dict[str, Any]], offset: float, final: bool) -> List[Dict[str, Any]]:
+        """
+        Commit decoded segments and drop their audio from the buffer. The last
+        segment may still be growing, so it stays tentative unless final.
+        
+        Args:
+            segments: Segments with times relative to the decoded snapshot
+            offset: Stream time of the snapshot start
+            final: Commit everything (end of stream)
+            
+        Returns:
+            Tentative segments, in stream time
+        """
+        absolute = [
+            {**seg, "start": offset + seg["start"], "end": offset + seg["end"]}
+            for seg in segments
+        ]
+        done, tentative = (absolute, []) if final else (absolute[:-1], absolute[-1:])
+        if done:
+            self.committed.extend(done)
+            cut = int((done[-1]["end"] - self.offset) * SAMPLE_RATE)
+            if cut > 0:
+                self._drop(cut)
+        return tentative
+
+
 class WhisperServer:
-    def __init__(self, model_size: str = "base", device: str = "auto"):
+    def __init__(self, model_size: str = "base", device: str = "auto", workers: int = 2,
+                 cache_dir: Optional[str] = None, compute_type: str = "auto"):
         """
         Initialize Whisper server
         
         Args:
             model_size: Whisper model size (tiny, base, small, medium, large)
             device: Device to run on (auto, cpu, cuda)
+            workers: Transcriptions the model runs in parallel
+            cache_dir: Persistent directory for converted model files
+            compute_type: CTranslate2 compute type (auto, int8, int8_float16, float16, ...)
         """
         self.model_size = model_size
         self.device = self._determine_device(device)
-        self.model: Optional[whisper.Whisper] = None
+        # Resolved in initialize_model, where a missing CUDA runtime is reported cleanly
+        self.compute_type = compute_type
+        self.cache_dir = cache_dir
+        self.model: Optional[WhisperModel] = None
+        # Dedicated threads for model calls, one per CTranslate2 worker
+        self.workers = workers
+        self.model_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="whisper")
         self.clients: Dict[str, websockets.WebSocketServerProtocol] = {}
+        self.streams: Dict[websockets.WebSocketServerProtocol, AudioStream] = {}
+        self.formats: Dict[websockets.WebSocketServerProtocol, str] = {}
+        self.welcome_frame = encode_message({
+            "type": "connection",
+            "status": "connected",
+            "model": self.model_size,
+            "device": self.device
+        })
+        # Two-stage pipeline: container decode -> model; created by start_pipeline
+        self.audio_q: Optional[asyncio.Queue] = None
+        self.feature_q: Optional[asyncio.Queue] = None
+        self.pipeline_tasks: List[asyncio.Task] = []
         
         logger.info(f"Initializing Whisper server with model '{model_size}' on device '{self.device}'")
     
     def _determine_device(self, device: str) -> str:
         """Determine the best device to use"""
         if device == "auto":
-            if torch.cuda.is_available():
+            if ctranslate2.get_cuda_device_count() > 0:
                 return "cuda"
-            elif hasattr(torch.backends, 'mps') and torch.backends.mps.is_available():
-                return "mps"  # Apple Silicon
             else:
                 return "cpu"
+        if device == "mps":
+            # CTranslate2 has no Metal backend; its CPU path is the fastest option
+            logger.warning("MPS is not supported by CTranslate2, using CPU")
+            return "cpu"
         return device
     
+    def _determine_compute_type(self, compute_type: str) -> str:
+        """Pick the fastest compute type this device supports"""
+        supported = ctranslate2.get_supported_compute_types(self.device)
+        if compute_type != "auto":
+            if compute_type in supported:
+                return compute_type
+            logger.warning(f"Compute type '{compute_type}' not supported on {self.device}, choosing automatically")
+        
+        # INT8 weights first; on GPU prefer FP16 (tensor cores) then BF16 activations
+        if self.device == "cuda":
+            preferred = ["int8_float16", "int8_bfloat16", "float16", "bfloat16", "int8", "float32"]
+        else:
+            preferred = ["int8", "int8_float32", "bfloat16", "float32"]
+        for candidate in preferred:
+            if candidate in supported:
+                return candidate
+        return "default"
+    
     async def initialize_model(self):
         """Load the Whisper model asynchronously"""
         try:
-            logger.info(f"Loading Whisper model '{self.model_size}' on {self.device}...")
+            self.compute_type = self._determine_compute_type(self.compute_type)
+            logger.info(f"Loading Whisper model '{self.model_size}' on {self.device} ({self.compute_type})...")
             
             # Load model in a thread to avoid blocking
-            loop = asyncio.get_event_loop()
-            self.model = await loop.run_in_executor(
-                None, 
-                lambda: whisper.load_model(self.model_size, device=self.device)
-            )
+            loop = asyncio.get_running_loop()
+            self.model = await loop.run_in_executor(None, self._load_model)
             
             logger.info("Whisper model loaded successfully")
+            await self.warm_up()
             return True
             
         except Exception as e:
             logger.error(f"Failed to load Whisper model: {e}")
             return False
     
-    async def transcribe_audio(self, audio_data: bytes, language: str = None) -> Dict[str, Any]:
+    async def warm_up(self):
+        """
+        Run one dummy decode per worker so CUDA context setup, cuBLAS handle
+        creation and allocator growth happen at startup, not on the first request
+        """
+        dummy = np.zeros(SAMPLE_RATE, dtype=np.float32)
+        
+        def decode():
+            # vad_filter would drop silence before it reaches the model
+            segments, _ = self.model.transcribe(dummy, language="en", vad_filter=False, beam_size=1)
+            list(segments)
+        
+        try:
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            await asyncio.gather(*[
+                loop.run_in_executor(self.model_executor, decode)
+                for _ in range(self.workers)
+            ])
+            logger.info(f"Model warmed up in {loop.time() - start:.2f}s")
+        except Exception as e:
+            logger.warning(f"Model warm-up failed: {e}")
+    
+    def _load_model(self) -> WhisperModel:
+        """Load from the local cache when possible, downloading only on a miss"""
+        def load(local_files_only: bool) -> WhisperModel:
+            return WhisperModel(
+                self.model_size,
+                device=self.device,
+                compute_type=self.compute_type,
+                num_workers=self.workers,
+                download_root=self.cache_dir,
+                local_files_only=local_files_only
+            )
+        
+        if self.cache_dir:
+            try:
+                # Warm start: skip the Hugging Face Hub round trip entirely
+                return load(local_files_only=True)
+            except Exception:
+                logger.info(f"Model not cached in {self.cache_dir}, downloading...")
+        return load(local_files_only=False)
+    
+    def start_pipeline(self):
+        """
+        Start the decode and transcribe stages. Decoding the next clip (PyAV,
+        CPU) overlaps with the model working on the current one instead of
+        both running back to back inside one executor call.
+        """
+        self.audio_q = asyncio.Queue()
+        self.feature_q = asyncio.Queue(maxsize=PIPELINE_DEPTH)
+        self.pipeline_tasks = [asyncio.create_task(self._decode_loop())] + [
+            asyncio.create_task(self._transcribe_loop())
+            for _ in range(self.workers)
+        ]
+    
+    async def _decode_loop(self):
+        """Stage 1: turn compressed audio bytes into 16 kHz float32 samples"""
+        loop = asyncio.get_running_loop()
+        while True:
+            audio_data, language, future = await self.audio_q.get()
+            try:
+                audio = await loop.run_in_executor(None, decode_audio_bytes, audio_data)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            # Blocks when the model is PIPELINE_DEPTH clips behind
+            await self.feature_q.put((audio, language, None, future))
+    
+    async def _transcribe_loop(self):
+        """Stage 2: run the model on decoded samples (one loop per worker)"""
+        loop = asyncio.get_running_loop()
+        while True:
+            audio, language, prompt, future = await self.feature_q.get()
+            if future.done():
+                # Caller went away while the clip was queued
+                continue
+            try:
+                result = await loop.run_in_executor(
+                    self.model_executor,
+                    lambda: self._transcribe_sync(audio, language, prompt)
+                )
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            if not future.done():
+                future.set_result(result)
+    
+    async def transcribe_samples(self, audio: np.ndarray, language: str = None,
+                                 prompt: str = None) -> Dict[str, Any]:
+        """Queue already-decoded samples straight into the transcribe stage"""
+        future = asyncio.get_running_loop().create_future()
+        await self.feature_q.put((audio, language, prompt, future))
+        return await future
+    
+    async def transcribe_audio(self, audio_data: bytes, language: str = None,
+                               audio_format: str = "container") -> Dict[str, Any]:
         """
         Transcribe audio data using Whisper
         
         Args:
             audio_data: Raw audio bytes
             language: Optional language hint
+            audio_format: "container" (WebM, WAV, ...) or raw 16 kHz mono "pcm16"
             
         Returns:
             Dictionary with transcription results
@@ -86,104 +352,106 @@ class WhisperServer:
             return {"error": "Model not loaded"}
         
         try:
-            # Save audio data to temporary file
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-                temp_file.write(audio_data)
-                temp_file_path = temp_file.name
+            # Transcribe audio
+            logger.info("Transcribing audio...")
+            if audio_format == "pcm16":
+                # Already at Whisper's rate: one numpy pass, no container decode stage
+                transcription = await self.transcribe_samples(pcm16_to_float32(audio_data), language)
+            else:
+                future = asyncio.get_running_loop().create_future()
+                await self.audio_q.put((audio_data, language, future))
+                transcription = await future
             
-            try:
-                # Transcribe audio
-                logger.info("Transcribing audio...")
-                loop = asyncio.get_event_loop()
-                
-                result = await loop.run_in_executor(
-                    None,
-                    lambda: self.model.transcribe(
-                        temp_file_path,
-                        language=language,
-                        fp16=False,  # Use fp32 for better compatibility
-                        verbose=False
-                    )
-                )
-                
-                # Extract relevant information
-                transcription = {
-                    "text": result["text"].strip(),
-                    "language": result["language"],
-                    "segments": [
-                        {
-                            "start": seg["start"],
-                            "end": seg["end"],
-                            "text": seg["text"].strip()
-                        }
-                        for seg in result["segments"]
-                    ]
-                }
-                
-                logger.info(f"Transcription completed: '{transcription['text']}'")
-                return transcription
-                
-            finally:
-                # Clean up temporary file
-                if os.path.exists(temp_file_path):
-                    os.unlink(temp_file_path)
+            logger.info(f"Transcription completed: '{transcription['text']}'")
+            return transcription
                     
         except Exception as e:
             logger.error(f"Transcription error: {e}")
             return {"error": str(e)}
     
+    def _transcribe_sync(self, audio, language: str = None, prompt: str = None) -> Dict[str, Any]:
+        """Run the blocking CTranslate2 transcription and build the result dict"""
+        segments, info = self.model.transcribe(
+            audio,
+            language=language,
+            initial_prompt=prompt,
+            vad_filter=True,
+            beam_size=1
+        )
+        # segments is a lazy generator; decoding happens while iterating it
+        segments = list(segments)
+        
+        # Extract relevant information
+        return {
+            "text": "".join(seg.text for seg in segments).strip(),
+            "language": info.language,
+            "segments": [
+                {
+                    "start": seg.start,
+                    "end": seg.end,
+                    "text": seg.text.strip()
+                }
+                for seg in segments
+            ]
+        }
+    
     async def handle_client(self, websocket, path):
         """Handle WebSocket client connections"""
         client_id = f"{websocket.remote_address[0]}:{websocket.remote_address[1]}"
         logger.info(f"Client connected: {client_id}")
         
         self.clients[client_id] = websocket
+        # One whole-message transcription in flight per client; extra blobs are refused
+        busy = asyncio.Semaphore(1)
+        loop = asyncio.get_running_loop()
+        job: Optional[asyncio.Task] = None
         
         try:
             # Send welcome message
-            await websocket.send(json.dumps({
-                "type": "connection",
-                "status": "connected",
-                "model": self.model_size,
-                "device": self.device
-            }))
+            await websocket.send(self.welcome_frame)
             
             async for message in websocket:
                 try:
-                    if isinstance(message, bytes):
+                    if isinstance(message, bytes) and websocket in self.streams:
+                        # Streaming mode: raw PCM16 chunks extend the client's buffer
+                        self.streams[websocket].append(pcm16_to_float32(message))
+                        
+                    elif isinstance(message, bytes):
                         # Handle binary audio data
                         logger.info(f"Received audio data from {client_id}: {len(message)} bytes")
                         
-                        # Send acknowledgment
-                        await websocket.send(json.dumps({
-                            "type": "status",
-                            "message": "Processing audio..."
-                        }))
-                        
-                        # Transcribe audio
-                        result = await self.transcribe_audio(message)
+                        if busy.locked():
+                            # Don't let a fast sender pile up jobs behind the model
+                            await websocket.send(BUSY_FRAME)
+                            continue
                         
-                        # Send result back to client
-                        await websocket.send(json.dumps({
-                            "type": "transcription",
-                            "result": result,
-                            "timestamp": asyncio.get_event_loop().time()
-                        }))
+                        # Transcribe in the background so commands (ping, stop_stream)
+                        # and further frames are still read meanwhile
+                        await busy.acquire()
+                        # Ack before spawning so it precedes any Busy reply to later frames
+                        await websocket.send(PROCESSING_FRAME)
+                        job = asyncio.create_task(self._transcribe_message(websocket, message, busy, loop))
                         
                     else:
                         # Handle text messages (JSON commands)
+                        if len(message) > MAX_COMMAND_SIZE:
+                            await websocket.send(encode_message({
+                                "type": "error",
+                                "message": "Command too large"
+                            }))
+                            continue
                         try:
-                            data = json.loads(message)
+                            data = orjson.loads(message)
                             await self.handle_command(websocket, data)
-                        except json.JSONDecodeError:
-                            await websocket.send(json.dumps({
+                        except orjson.JSONDecodeError:
+                            await websocket.send(encode_message({
                                 "type": "error",
                                 "message": "Invalid JSON format"
                             }))
                             
                 except Exception as e:
                     logger.error(f"Error processing message from {client_id}: {e}")
-                    await websocket.send(json.dumps({
+                    await websocket.send(encode_message({
                         "type": "error",
                         "message": str(e)
                     }))
@@ -193,21 +461,99 @@ class WhisperServer:
         except Exception as e:
             logger.error(f"Connection error with {client_id}: {e}")
         finally:
+            if job and not job.done():
+                job.cancel()
+            self._close_stream(websocket)
+            self.formats.pop(websocket, None)
             if client_id in self.clients:
                 del self.clients[client_id]
     
+    async def _transcribe_message(self, websocket, message: bytes, busy: asyncio.Semaphore,
+                                  loop: asyncio.AbstractEventLoop):
+        """Transcribe one binary message and send the result, then release the client"""
+        try:
+            # Transcribe audio
+            result = await self.transcribe_audio(
+                message,
+                audio_format=self.formats.get(websocket, "container")
+            )
+            
+            # Send result back to client
+            await websocket.send(encode_message({
+                "type": "transcription",
+                "result": result,
+                "timestamp": loop.time()
+            }))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            busy.release()
+    
+    def _close_stream(self, websocket) -> Optional[AudioStream]:
+        """Detach a client's stream and stop its decode loop"""
+        stream = self.streams.pop(websocket, None)
+        if stream and stream.task:
+            stream.task.cancel()
+        return stream
+    
+    async def _stream_loop(self, websocket, stream: AudioStream):
+        """Periodically decode the uncommitted tail of a stream"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(STREAM_INTERVAL)
+            if stream.pending:
+                try:
+                    # Silence since the last decode can't change the transcript;
+                    # a few ms of VAD saves a full encoder/decoder pass
+                    if not await loop.run_in_executor(None, has_speech, stream.recent().copy()):
+                        stream.pending = 0
+                        continue
+                    await self._decode_stream(websocket, stream, final=False)
+                except websockets.exceptions.ConnectionClosed:
+                    return
+                except Exception as e:
+                    logger.error(f"Stream decode error: {e}")
+                    try:
+                        await websocket.send(encode_message({
+                            "type": "error",
+                            "message": f"Stream decode error: {str(e)}"
+                        }))
+                    except websockets.exceptions.ConnectionClosed:
+                        return
+    
+    async def _decode_stream(self, websocket, stream: AudioStream, final: bool):
+        """Transcribe the buffered audio, commit finished segments and send the result"""
+        stream.pending = 0
+        tentative = []
+        if len(stream.buffer):
+            audio, offset = stream.buffer.copy(), stream.offset
+            result = await self.transcribe_samples(audio, stream.language, stream.prompt())
+            # Pin the detected language so later decodes skip detection
+            stream.language = stream.language or result["language"]
+            tentative = stream.commit(result["segments"], offset, final)
+        
+        segments = stream.committed + tentative
+        await websocket.send(encode_message({
+            "type": "transcription",
+            "result": {
+                "text": " ".join(seg["text"] for seg in segments).strip(),
+                "committed": " ".join(seg["text"] for seg in stream.committed).strip(),
+                "language": stream.language,
+                "segments": segments
+            },
+            "final": final,
+            "timestamp": asyncio.get_running_loop().time()
+        }))
+    
     async def handle_command(self, websocket, data: Dict[str, Any]):
         """Handle JSON commands from clients"""
         command = data.get("command")
         
         if command == "ping":
-            await websocket.send(json.dumps({
-                "type": "pong",
-                "timestamp": asyncio.get_event_loop().time()
-            }))
+            await websocket.send(f"{PONG_PREFIX}{asyncio.get_running_loop().time()!r}}}")
             
         elif command == "status":
-            await websocket.send(json.dumps({
+            await websocket.send(encode_message({
                 "type": "status",
                 "model": self.model_size,
                 "device": self.device,
@@ -215,6 +561,45 @@ class WhisperServer:
                 "model_loaded": self.model is not None
             }))
             
+        elif command == "set_format":
+            # How whole-message binary audio is decoded for this connection
+            audio_format = data.get("format")
+            if audio_format in AUDIO_FORMATS:
+                self.formats[websocket] = audio_format
+                await websocket.send(encode_message({
+                    "type": "status",
+                    "message": f"Audio format set to {audio_format}",
+                    "format": audio_format
+                }))
+            else:
+                await websocket.send(encode_message({
+                    "type": "error",
+                    "message": f"Unknown audio format: {audio_format}"
+                }))
+            
+        elif command == "start_stream":
+            # Switch binary frames to raw 16 kHz mono PCM16 chunks
+            self._close_stream(websocket)
+            stream = AudioStream(language=data.get("language"))
+            stream.task = asyncio.create_task(self._stream_loop(websocket, stream))
+            self.streams[websocket] = stream
+            await websocket.send(encode_message({
+                "type": "status",
+                "message": "Streaming started",
+                "sample_rate": SAMPLE_RATE
+            }))
+            
+        elif command == "stop_stream":
+            # Final decode of whatever is left, then back to whole-blob mode
+            stream = self._close_stream(websocket)
+            if stream:
+                await self._decode_stream(websocket, stream, final=True)
+            else:
+                await websocket.send(encode_message({
+                    "type": "error",
+                    "message": "No active stream"
+                }))
+            
         elif command == "transcribe_file":
             # Handle file transcription if needed
             file_path = data.get("file_path")
@@ -222,19 +607,19 @@ class WhisperServer:
                 with open(file_path, "rb") as f:
                     audio_data = f.read()
                 result = await self.transcribe_audio(audio_data, data.get("language"))
-                await websocket.send(json.dumps({
+                await websocket.send(encode_message({
                     "type": "transcription",
                     "result": result,
                     "source": "file",
                     "file_path": file_path
                 }))
             else:
-                await websocket.send(json.dumps({
+                await websocket.send(encode_message({
                     "type": "error",
                     "message": "File not found or path not provided"
                 }))
         else:
-            await websocket.send(json.dumps({
+            await websocket.send(encode_message({
                 "type": "error",
                 "message": f"Unknown command: {command}"
             }))
@@ -248,6 +633,8 @@ class WhisperServer:
             logger.error("Failed to initialize model, server cannot start")
             return
         
+        self.start_pipeline()
+        
         # Start WebSocket server
         async with websockets.serve(
             self.handle_client,
@@ -256,6 +643,7 @@ class WhisperServer:
             ping_interval=30,
             ping_timeout=10,
             max_size=50 * 1024 * 1024,  # 50MB max message size for large audio files
+            compression=None,  # Audio is already compressed or raw PCM; deflate only costs CPU
         ):
             logger.info(f"Whisper server is running on ws://{host}:{port}")
             logger.info("Server ready to accept connections")
@@ -270,9 +658,18 @@ async def main():
     device = os.getenv("WHISPER_DEVICE", "auto")     # auto, cpu, cuda, mps
     host = os.getenv("WHISPER_HOST", "0.0.0.0")
     port = int(os.getenv("WHISPER_PORT", "9000"))
+    workers = int(os.getenv("WHISPER_WORKERS", "2"))  # Parallel transcriptions
+    cache_dir = os.getenv("WHISPER_CACHE_DIR")        # Persistent model cache
+    compute_type = os.getenv("WHISPER_COMPUTE_TYPE", "auto")  # auto, int8, int8_float16, float16, float32
     
     # Create and start server
-    server = WhisperServer(model_size=model_size, device=device)
+    server = WhisperServer(
+        model_size=model_size,
+        device=device,
+        workers=workers,
+        cache_dir=cache_dir,
+        compute_type=compute_type
+    )
     
     try:
         await server.start_server(host=host, port=port)
@@ -282,4 +679,10 @@ async def main():
         logger.error(f"Server error: {e}")
 
 if __name__ == "__main__":
+    try:
+        # Faster event loop for the websocket I/O; not available on Windows
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
     asyncio.run(main())